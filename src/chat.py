@@ -1,12 +1,17 @@
 import os
 import argparse
+import hashlib
 from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    SystemMessagePromptTemplate,
+)
 from langchain_core.output_parsers import StrOutputParser
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
 from src.utils import check_env_vars, v_print
-from src.search import DocumentSearcher
+from src.search import DocumentSearcher, normalize_query, SEMANTIC_CACHE_SIZE
 
 def get_chat_model(provider: str, verbose: bool = False):
     """Retorna a instância do modelo de chat com base no provedor."""
@@ -24,10 +29,12 @@ def get_chat_model(provider: str, verbose: bool = False):
 
 def format_context(docs_with_scores, verbose_print):
     """Formata os documentos recuperados em uma string de contexto."""
+    basename = os.path.basename
     context = []
     verbose_print("\n--- Documentos Recuperados ---")
     for i, (doc, score) in enumerate(docs_with_scores):
-        source_info = f"Fonte: {os.path.basename(doc.metadata.get('source', 'N/A'))}, Página: {doc.metadata.get('page', 'N/A')}"
+        metadata = doc.metadata
+        source_info = f"Fonte: {basename(metadata.get('source', 'N/A'))}, Página: {metadata.get('page', 'N/A')}"
         context.append(f"{doc.page_content}\n({source_info})")
         verbose_print(f"Doc {i+1} (Score: {score:.4f}): {source_info}\n{doc.page_content[:100]}...")
     verbose_print("--------------------------\n")
@@ -47,6 +54,13 @@ def main():
         choices=['google', 'openai'],
         help="O provedor de LLM a ser usado: 'google' ou 'openai' (padrão: google)."
     )
+    parser.add_argument(
+        "--embeddings-provider",
+        type=str,
+        default=None,
+        choices=['google', 'openai', 'local', 'local-onnx'],
+        help="O provedor de embeddings usado na busca; deve ser o mesmo da ingestão (padrão: o mesmo de --provider)."
+    )
     parser.add_argument(
         "-v", "--verbose",
         action="store_true",
@@ -54,24 +68,26 @@ def main():
     )
     args = parser.parse_args()
     verbose_print = v_print(args.verbose)
+    embeddings_provider = args.embeddings_provider or args.provider
 
     try:
         check_env_vars(args.provider)
+        check_env_vars(embeddings_provider)
     except EnvironmentError as e:
         print(f"Erro de configuração: {e}")
         return
 
     try:
-        searcher = DocumentSearcher(provider=args.provider, verbose=args.verbose)
+        searcher = DocumentSearcher(provider=embeddings_provider, verbose=args.verbose)
         llm = get_chat_model(args.provider, args.verbose)
     except (ConnectionError, ValueError) as e:
         print(f"Erro na inicialização: {e}")
         return
 
-    prompt_template = """CONTEXTO:
-{context}
-
-REGRAS:
+    # As regras estáticas ficam na mensagem de sistema, antes de qualquer conteúdo
+    # dinâmico, para que o prefixo do prompt seja reaproveitado pelo cache de
+    # prompts dos provedores.
+    system_template = """REGRAS:
 - Responda somente com base no CONTEXTO.
 - Se a informação não estiver explicitamente no CONTEXTO, responda:
   "Não tenho informações necessárias para responder sua pergunta."
@@ -87,15 +103,24 @@ Resposta: "Não tenho informações necessárias para responder sua pergunta."
 
 Pergunta: "Você acha isso bom ou ruim?"
 Resposta: "Não tenho informações necessárias para responder sua pergunta."
+"""
+    human_template = """CONTEXTO:
+{context}
 
 PERGUNTA DO USUÁRIO:
 {question}
 
 RESPONDA A "PERGUNTA DO USUÁRIO"
 """
-    prompt = ChatPromptTemplate.from_template(prompt_template)
+    prompt = ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(system_template),
+        HumanMessagePromptTemplate.from_template(human_template),
+    ])
     chain = prompt | llm | StrOutputParser()
 
+    # Cache de respostas indexado pela pergunta normalizada e pelo hash do contexto.
+    response_cache = {}
+
     print(f"--- Chat com Documento PDF (Provedor: {args.provider}) ---")
     print("Digite sua pergunta ou 'sair' para terminar.")
 
@@ -114,10 +139,24 @@ RESPONDA A "PERGUNTA DO USUÁRIO"
             if not context:
                 verbose_print("Nenhum documento relevante encontrado para a consulta.")
 
-            verbose_print("\nGerando resposta...")
-            response = chain.invoke({"context": context, "question": question})
-            print("\nResposta:")
-            print(response)
+            inputs = {"context": context, "question": question}
+            prompt_key = (normalize_query(question), hashlib.sha256(context.encode("utf-8")).hexdigest())
+            response = response_cache.get(prompt_key)
+            if response is None:
+                verbose_print("\nGerando resposta...")
+                print("\nResposta:")
+                chunks = []
+                for chunk in chain.stream(inputs):
+                    print(chunk, end="", flush=True)
+                    chunks.append(chunk)
+                print()
+                if len(response_cache) >= SEMANTIC_CACHE_SIZE:
+                    response_cache.pop(next(iter(response_cache)))
+                response_cache[prompt_key] = "".join(chunks)
+            else:
+                verbose_print("\nResposta recuperada do cache.")
+                print("\nResposta:")
+                print(response)
 
         except Exception as e:
             print(f"\nOcorreu um erro durante o chat: {e}")
@@ -1,10 +1,249 @@
 import os
+import pickle
+import hashlib
+import asyncio
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pypdfium2 as pdfium
+import psycopg
+from psycopg import sql
+from psycopg.types.json import Jsonb
+from pgvector.psycopg import register_vector
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_postgres import PGVector
-from src.utils import get_connection_string, check_env_vars, get_embeddings_model, v_print
+from src.utils import (
+    get_connection_string,
+    get_engine,
+    get_psycopg_connection_string,
+    hnsw_index_prefix,
+    check_env_vars,
+    get_embeddings_model,
+    v_print,
+)
+
+CACHE_DIR = ".cache"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+# Identifica o extrator de texto; alterá-lo invalida os chunks em cache gerados por outro extrator.
+PDF_EXTRACTOR = "pdfium"
+PAGES_PER_WORKER = 8
+
+def extract_pages(path: str, start: int, stop: int):
+    """Extrai o texto das páginas [start, stop) do PDF, uma Document por página."""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        total_pages = len(pdf)
+        docs = []
+        for i in range(start, stop):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range().replace("\r\n", "\n")
+            finally:
+                textpage.close()
+                page.close()
+            docs.append(Document(page_content=text, metadata={"source": path, "page": i, "total_pages": total_pages}))
+        return docs
+    finally:
+        pdf.close()
+
+def load_pdf(path: str):
+    """
+    Carrega o PDF com o PDFium, distribuindo faixas de páginas entre processos.
+
+    Cada processo recebe pelo menos PAGES_PER_WORKER páginas; PDFs pequenos são
+    extraídos no próprio processo, sem o custo de iniciar workers.
+    """
+    pdf = pdfium.PdfDocument(path)
+    total_pages = len(pdf)
+    pdf.close()
+
+    workers = min(os.cpu_count() or 1, -(-total_pages // PAGES_PER_WORKER))
+    if workers <= 1:
+        return extract_pages(path, 0, total_pages)
+
+    step = -(-total_pages // workers)
+    starts = list(range(0, total_pages, step))
+    stops = [min(start + step, total_pages) for start in starts]
+    with ProcessPoolExecutor(max_workers=len(starts)) as executor:
+        results = executor.map(extract_pages, [path] * len(starts), starts, stops)
+    return [doc for docs in results for doc in docs]
+
+def load_split_documents(path: str, verbose_print):
+    """
+    Carrega o PDF e o divide em chunks, reaproveitando o resultado salvo em disco
+    quando o arquivo não mudou desde a última execução.
+
+    O caminho faz parte da chave porque é gravado em `metadata["source"]` de cada chunk.
+    """
+    digest = hashlib.sha256(path.encode("utf-8") + b"\0")
+    with open(path, "rb") as f:
+        digest.update(f.read())
+    cache_path = os.path.join(
+        CACHE_DIR, f"{digest.hexdigest()}-{PDF_EXTRACTOR}-{CHUNK_SIZE}-{CHUNK_OVERLAP}.pkl"
+    )
+    if os.path.exists(cache_path):
+        verbose_print(f"Chunks recuperados do cache: {cache_path}")
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+
+    docs = load_pdf(path)
+    verbose_print(f"Documento carregado com {len(docs)} página(s).")
+
+    verbose_print("Dividindo o documento em chunks...")
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    split_docs = text_splitter.split_documents(docs)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(cache_path, "wb") as f:
+        pickle.dump(split_docs, f)
+    return split_docs
+
+def chunk_id(provider: str, collection_name: str, doc) -> str:
+    """Gera um identificador determinístico para o chunk, usado para detectar alterações entre ingestões."""
+    metadata = doc.metadata
+    key = (
+        f"{provider}\0{collection_name}\0{metadata.get('source', '')}\0"
+        f"{metadata.get('page', '')}\0{doc.page_content}"
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def positive_int(value: str) -> int:
+    """Tipo do argparse que aceita apenas inteiros maiores ou iguais a 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"o valor deve ser um inteiro maior ou igual a 1 (recebido: {value}).")
+    return number
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Indica se o erro retornado pelo provedor corresponde a um limite de requisições (HTTP 429).
+
+    A cadeia de causas é percorrida porque alguns provedores encapsulam o erro da API:
+    o langchain-google-genai levanta GoogleGenerativeAIError a partir de ResourceExhausted.
+    """
+    while error is not None:
+        status = getattr(error, "status_code", None) or getattr(error, "code", None)
+        if status == 429:
+            return True
+        error = error.__cause__
+    return False
+
+async def embed_all(embeddings, batches, concurrency: int, verbose_print, max_retries: int = 5):
+    """
+    Gera os embeddings de todos os lotes concorrentemente, limitando o número de
+    requisições simultâneas e repetindo com backoff exponencial em caso de HTTP 429.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def embed_batch(index, batch):
+        async with semaphore:
+            for attempt in range(max_retries + 1):
+                try:
+                    verbose_print(f"Gerando embeddings do lote {index + 1}/{len(batches)} ({len(batch)} chunks)...")
+                    return await embeddings.aembed_documents(batch)
+                except Exception as e:
+                    if attempt == max_retries or not is_rate_limit_error(e):
+                        raise
+                    delay = 2 ** attempt
+                    verbose_print(f"Limite de requisições atingido no lote {index + 1}. Tentando novamente em {delay}s...")
+                    await asyncio.sleep(delay)
+
+    results = await asyncio.gather(*(embed_batch(i, batch) for i, batch in enumerate(batches)))
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+def get_collection_state(collection_name: str):
+    """Retorna o id da coleção e o conjunto de ids dos chunks já armazenados nela."""
+    with psycopg.connect(get_psycopg_connection_string()) as conn:
+        collection_id = conn.execute(
+            "SELECT uuid FROM langchain_pg_collection WHERE name = %s", (collection_name,)
+        ).fetchone()[0]
+        rows = conn.execute(
+            "SELECT id FROM langchain_pg_embedding WHERE collection_id = %s", (collection_id,)
+        ).fetchall()
+    return collection_id, {row[0] for row in rows}
+
+def bulk_insert_embeddings(collection_id, ids, texts, vectors, metadatas, stale_ids):
+    """
+    Sincroniza os embeddings da coleção usando o protocolo COPY binário do PostgreSQL.
+
+    A remoção dos chunks que deixaram de existir e a inserção dos novos ocorrem na
+    mesma transação.
+    """
+    with psycopg.connect(get_psycopg_connection_string()) as conn:
+        register_vector(conn)
+        with conn.cursor() as cur:
+            if stale_ids:
+                cur.execute(
+                    "DELETE FROM langchain_pg_embedding WHERE collection_id = %s AND id = ANY(%s)",
+                    (collection_id, list(stale_ids)),
+                )
+            with cur.copy(
+                "COPY langchain_pg_embedding (id, collection_id, embedding, document, cmetadata) "
+                "FROM STDIN WITH (FORMAT BINARY)"
+            ) as copy:
+                copy.set_types(["varchar", "uuid", "vector", "varchar", "jsonb"])
+                for id_, text, vector, metadata in zip(ids, texts, vectors, metadatas):
+                    copy.write_row((
+                        id_,
+                        collection_id,
+                        np.asarray(vector, dtype=np.float32),
+                        text,
+                        Jsonb(metadata),
+                    ))
+
+def create_hnsw_index(collection_id, index_type, verbose_print):
+    """
+    Cria o índice HNSW (distância de cosseno) dos embeddings da coleção.
+
+    A coluna de embeddings é compartilhada por todas as coleções e não tem dimensão
+    fixa, então o índice é parcial (restrito à coleção) e construído sobre a
+    expressão embedding::vector(N), ou embedding::halfvec(N) para o índice em meia
+    precisão, já que o pgvector só indexa vetores de dimensão fixa. Sem
+    `index_type`, o tipo do índice atual da coleção é mantido (vector quando ainda
+    não há índice). Índices da coleção com outro tipo ou dimensão são removidos.
+    """
+    try:
+        with psycopg.connect(get_psycopg_connection_string()) as conn:
+            row = conn.execute(
+                "SELECT vector_dims(embedding) FROM langchain_pg_embedding WHERE collection_id = %s LIMIT 1",
+                (collection_id,),
+            ).fetchone()
+            if row is None:
+                return
+            prefix = hnsw_index_prefix(collection_id)
+            existing = conn.execute(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE tablename = 'langchain_pg_embedding' AND starts_with(indexname, %s)",
+                (prefix,),
+            ).fetchall()
+            if index_type is None:
+                index_type = existing[0][0][len(prefix):].rsplit("_", 1)[0] if existing else "vector"
+            index_name = f"{prefix}{index_type}_{row[0]}"
+            for (name,) in existing:
+                if name != index_name:
+                    verbose_print(f"Removendo o índice {name}...")
+                    conn.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(name)))
+
+            verbose_print(f"Criando o índice HNSW {index_name}...")
+            conn.execute(
+                sql.SQL(
+                    "CREATE INDEX IF NOT EXISTS {name} ON langchain_pg_embedding "
+                    "USING hnsw ((embedding::{cast}) {ops}) WITH (m = 16, ef_construction = 64) "
+                    "WHERE collection_id = {collection_id}"
+                ).format(
+                    name=sql.Identifier(index_name),
+                    cast=sql.SQL(f"{index_type}({row[0]})"),
+                    ops=sql.SQL(f"{index_type}_cosine_ops"),
+                    collection_id=sql.Literal(collection_id),
+                )
+            )
+            conn.execute("ANALYZE langchain_pg_embedding")
+    except psycopg.Error as e:
+        print(f"Aviso: não foi possível criar o índice HNSW; as buscas usarão varredura sequencial. Detalhes: {e}")
 
 def main():
     """
@@ -17,8 +256,8 @@ def main():
         "--provider",
         type=str,
         default="google",
-        choices=['google', 'openai'],
-        help="O provedor de LLM a ser usado: 'google' ou 'openai' (padrão: google)."
+        choices=['google', 'openai', 'local', 'local-onnx'],
+        help="O provedor de embeddings a ser usado: 'google', 'openai', 'local' ou 'local-onnx' (padrão: google)."
     )
     parser.add_argument(
         "--path", 
@@ -32,6 +271,26 @@ def main():
         default="documentos_pdf", 
         help="O nome da coleção no banco de dados vetorial (padrão: documentos_pdf)."
     )
+    parser.add_argument(
+        "--batch-size",
+        type=positive_int,
+        default=96,
+        help="Quantidade de chunks enviados por requisição de embeddings (padrão: 96)."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=positive_int,
+        default=8,
+        help="Número máximo de requisições de embeddings simultâneas (padrão: 8)."
+    )
+    parser.add_argument(
+        "--index-type",
+        type=str,
+        default=None,
+        choices=['vector', 'halfvec'],
+        help="Precisão do índice HNSW da coleção: 'vector' (FP32) ou 'halfvec' (FP16, metade do tamanho). "
+             "Se omitido, mantém o tipo do índice atual da coleção (ou 'vector' na primeira ingestão)."
+    )
     parser.add_argument(
         "-v", "--verbose",
         action="store_true",
@@ -48,9 +307,8 @@ def main():
 
     verbose_print(f"Lendo o arquivo: {args.path}...")
     try:
-        loader = PyPDFLoader(args.path)
-        docs = loader.load()
-        verbose_print(f"Documento carregado com {len(docs)} página(s).")
+        split_docs = load_split_documents(args.path, verbose_print)
+        verbose_print(f"Documento dividido em {len(split_docs)} chunks.")
     except FileNotFoundError:
         print(f"Erro: O arquivo '{args.path}' não foi encontrado.")
         return
@@ -58,11 +316,6 @@ def main():
         print(f"Ocorreu um erro ao ler o PDF: {e}")
         return
 
-    verbose_print("Dividindo o documento em chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-    split_docs = text_splitter.split_documents(docs)
-    verbose_print(f"Documento dividido em {len(split_docs)} chunks.")
-
     try:
         embeddings = get_embeddings_model(args.provider, args.verbose)
     except ValueError as e:
@@ -72,15 +325,49 @@ def main():
     connection_string = get_connection_string()
     collection_name = args.collection
 
-    verbose_print(f"Salvando embeddings na coleção '{collection_name}' (Provedor: {args.provider})...")
-    PGVector.from_documents(
-        embedding=embeddings,
-        documents=split_docs,
-        collection_name=collection_name,
-        connection=connection_string,
-        pre_delete_collection=True,
+    try:
+        # Garante a existência da extensão, das tabelas e da coleção antes do COPY.
+        PGVector(
+            embeddings=embeddings,
+            collection_name=collection_name,
+            connection=get_engine(connection_string),
+        )
+        collection_id, existing_ids = get_collection_state(collection_name)
+    except Exception as e:
+        print(f"Erro ao acessar o banco de dados: {e}")
+        return
+
+    chunks = {chunk_id(args.provider, collection_name, doc): doc for doc in split_docs}
+    new_chunks = {id_: doc for id_, doc in chunks.items() if id_ not in existing_ids}
+    stale_ids = existing_ids - chunks.keys()
+    verbose_print(
+        f"{len(new_chunks)} chunk(s) novo(s), {len(chunks) - len(new_chunks)} inalterado(s) "
+        f"e {len(stale_ids)} removido(s)."
     )
 
+    texts = [doc.page_content for doc in new_chunks.values()]
+    batches = [texts[i:i + args.batch_size] for i in range(0, len(texts), args.batch_size)]
+    try:
+        vectors = asyncio.run(embed_all(embeddings, batches, args.concurrency, verbose_print))
+    except Exception as e:
+        print(f"Erro ao gerar os embeddings; nenhuma alteração foi aplicada à coleção. Detalhes: {e}")
+        return
+
+    verbose_print(f"Salvando embeddings na coleção '{collection_name}' (Provedor: {args.provider})...")
+    try:
+        bulk_insert_embeddings(
+            collection_id,
+            list(new_chunks.keys()),
+            texts,
+            vectors,
+            [doc.metadata for doc in new_chunks.values()],
+            stale_ids,
+        )
+    except psycopg.Error as e:
+        print(f"Erro ao salvar os embeddings; nenhuma alteração foi aplicada à coleção. Detalhes: {e}")
+        return
+    create_hnsw_index(collection_id, args.index_type, verbose_print)
+
     print("\nProcesso de ingestão concluído com sucesso!")
 
 if __name__ == '__main__':
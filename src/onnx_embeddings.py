@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+from langchain_core.embeddings import Embeddings
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Gera embeddings localmente com um modelo sentence-transformers exportado para
+    ONNX (quantizado em int8) e executado na CPU pelo ONNX Runtime.
+    """
+    def __init__(self, model_dir: str, model_file: str = "model_quantized.onnx", max_length: int = 256):
+        """
+        Carrega o modelo e o tokenizer a partir do diretório gerado pelo optimum-cli.
+        """
+        model_path = os.path.join(model_dir, model_file)
+        tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+        for path in (model_path, tokenizer_path):
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"Arquivo não encontrado: {path}")
+
+        self.session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def _embed(self, texts):
+        """Tokeniza os textos, executa o modelo e aplica mean pooling com normalização L2."""
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.zeros_like(input_ids),
+        }
+        last_hidden_state = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+
+        mask = attention_mask[:, :, np.newaxis].astype(np.float32)
+        pooled = (last_hidden_state * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.tolist()
+
+    def embed_documents(self, texts):
+        """Gera os embeddings de uma lista de textos."""
+        if not texts:
+            return []
+        return self._embed(texts)
+
+    def embed_query(self, text):
+        """Gera o embedding de uma única consulta."""
+        return self._embed([text])[0]
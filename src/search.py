@@ -1,7 +1,87 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from psycopg import sql
 from dotenv import load_dotenv
-from langchain_postgres import PGVector
-from src.utils import get_connection_string, check_env_vars, get_embeddings_model, v_print
+from langchain_core.documents import Document
+from src.utils import (
+    get_psycopg_connection_string,
+    get_pool,
+    hnsw_index_prefix,
+    HNSW_EF_SEARCH,
+    check_env_vars,
+    get_embeddings_model,
+    v_print,
+)
+
+SEMANTIC_CACHE_SIZE = 256
+
+
+def normalize_query(query: str) -> str:
+    """Normaliza a consulta (caixa e espaços) para uso como chave de cache."""
+    return " ".join(query.lower().split())
+
+
+def maximal_marginal_relevance(query_embedding, embeddings, k: int, lambda_mult: float):
+    """
+    Seleciona os índices de até `k` embeddings equilibrando relevância para a
+    consulta e diversidade entre os já escolhidos (Maximal Marginal Relevance).
+    """
+    if k < 1 or len(embeddings) == 0:
+        return []
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    q = np.asarray(query_embedding, dtype=np.float32)
+    q /= max(np.linalg.norm(q), 1e-12)
+
+    relevance = matrix @ q
+    selected = [int(np.argmax(relevance))]
+    redundancy = matrix @ matrix[selected[0]]
+    while len(selected) < min(k, len(matrix)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        i = int(np.argmax(scores))
+        selected.append(i)
+        redundancy = np.maximum(redundancy, matrix @ matrix[i])
+    return selected
+
+
+class SemanticCache:
+    """
+    Cache em memória que associa embeddings de consultas anteriores aos seus resultados.
+
+    Uma nova consulta reaproveita o resultado armazenado quando a similaridade de
+    cosseno com alguma consulta anterior atinge o limiar configurado.
+    """
+    def __init__(self, threshold: float = 0.97, max_size: int = SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_size = max_size
+        self._matrix = None
+        self._entries = []
+
+    def lookup(self, query_embedding):
+        """Retorna o resultado da consulta mais similar ou None se não houver acerto."""
+        if self._matrix is None:
+            return None
+        q = np.asarray(query_embedding, dtype=np.float32)
+        norms = np.linalg.norm(self._matrix, axis=1) * np.linalg.norm(q)
+        sims = (self._matrix @ q) / np.maximum(norms, 1e-12)
+        i = int(np.argmax(sims))
+        if sims[i] >= self.threshold:
+            return self._entries[i]
+        return None
+
+    def add(self, query_embedding, value):
+        """Armazena o resultado de uma consulta, descartando a entrada mais antiga se necessário."""
+        q = np.asarray(query_embedding, dtype=np.float32)[np.newaxis, :]
+        if self._matrix is None:
+            self._matrix = q
+        else:
+            if len(self._entries) >= self.max_size:
+                start = len(self._entries) - self.max_size + 1
+                self._matrix = self._matrix[start:]
+                self._entries = self._entries[start:]
+            self._matrix = np.vstack([self._matrix, q])
+        self._entries.append(value)
 
 
 class DocumentSearcher:
@@ -17,28 +97,122 @@ class DocumentSearcher:
         check_env_vars(provider)
         
         self.embeddings = get_embeddings_model(provider, verbose)
-        self.connection_string = get_connection_string()
         self.collection_name = collection_name
+        # Um cache semântico por combinação de parâmetros de busca (k, fetch_k, lambda_mult).
+        self.semantic_caches = {}
+        self.exact_cache = {}
+        self._executor = ThreadPoolExecutor(max_workers=2)
 
         try:
-            self.db = PGVector(
-                embeddings=self.embeddings,
-                collection_name=self.collection_name,
-                connection=self.connection_string,
-            )
+            # Sem pool, o banco ainda não tem a extensão vector e as tabelas: nada foi ingerido.
+            self.pool = get_pool(get_psycopg_connection_string())
+            row = None
+            if self.pool is not None:
+                with self.pool.connection() as conn:
+                    row = conn.execute(
+                        "SELECT uuid FROM langchain_pg_collection WHERE name = %s", (self.collection_name,)
+                    ).fetchone()
+                    if row is not None:
+                        self.collection_id = row[0]
+                        self.query = self._build_query(conn)
             self.verbose_print("Conexão com o banco de dados vetorial estabelecida com sucesso.")
         except Exception as e:
             raise ConnectionError(f"Não foi possível conectar ao banco de dados: {e}") from e
+        if row is None:
+            raise ConnectionError(f"A coleção '{self.collection_name}' não existe. Execute a ingestão primeiro.")
 
-    def search_documents(self, query: str, k: int = 10):
+    def _build_query(self, conn) -> str:
         """
-        Realiza uma busca por similaridade no banco de vetores.
+        Monta a consulta de vizinhos mais próximos da coleção.
+
+        A consulta é sempre a mesma para o buscador, então o psycopg a prepara uma
+        única vez por conexão. Quando a coleção tem um índice HNSW, a distância usa a
+        mesma expressão do índice (embedding::vector(N) ou embedding::halfvec(N)) e o
+        id da coleção é fixado na consulta para que o índice parcial seja elegível.
+
+        O tipo e a dimensão do índice são lidos apenas aqui, na criação do buscador.
+        Se uma ingestão posterior recriar o índice da coleção com outro tipo
+        (--index-type), a consulta deixa de corresponder a ele e o buscador já em
+        execução passa, sem aviso, a usar varredura sequencial até ser recriado.
+        """
+        prefix = hnsw_index_prefix(self.collection_id)
+        index = conn.execute(
+            "SELECT indexname FROM pg_indexes "
+            "WHERE tablename = 'langchain_pg_embedding' AND starts_with(indexname, %s)",
+            (prefix,),
+        ).fetchone()
+        if index is not None:
+            index_type, dimensions = index[0][len(prefix):].rsplit("_", 1)
+            cast = f"{index_type}({int(dimensions)})"
+            distance = f"(embedding::{cast}) <=> %(embedding)s::{cast}"
+        else:
+            self.verbose_print("Nenhum índice HNSW encontrado para a coleção; a busca usará varredura sequencial.")
+            distance = "embedding <=> %(embedding)s::vector"
+        return sql.SQL(
+            "SELECT id, document, cmetadata, embedding::vector, {distance} AS distance "
+            "FROM langchain_pg_embedding WHERE collection_id = {collection_id} "
+            "ORDER BY {distance} LIMIT %(limit)s"
+        ).format(
+            distance=sql.SQL(distance),
+            collection_id=sql.Literal(self.collection_id),
+        ).as_string(conn)
+
+    def search_documents(self, query: str, k: int = 5, fetch_k: int = 50, lambda_mult: float = 0.5):
+        """
+        Realiza uma busca no banco de vetores, recuperando `fetch_k` candidatos e
+        selecionando localmente os `k` mais relevantes e diversos via MMR.
         """
         self.verbose_print(f"Buscando por: '{query}'...")
-        similar_docs = self.db.similarity_search_with_score(query, k=k)
+        search_params = (k, fetch_k, lambda_mult)
+        semantic_cache = self.semantic_caches.setdefault(search_params, SemanticCache())
+        key = (normalize_query(query), *search_params)
+        if key in self.exact_cache:
+            self.verbose_print("Resultado recuperado do cache de consultas idênticas.")
+            return self.exact_cache[key]
+
+        # A conexão é obtida do pool enquanto a chamada de embeddings está em andamento.
+        embed_future = self._executor.submit(self.embeddings.embed_query, query)
+        conn_future = self._executor.submit(self.pool.getconn)
+        try:
+            query_embedding = embed_future.result()
+            cached = semantic_cache.lookup(query_embedding)
+            if cached is not None:
+                self.verbose_print("Resultado recuperado do cache semântico.")
+                self._remember(key, cached)
+                return cached
+
+            params = {
+                "embedding": np.asarray(query_embedding, dtype=np.float32),
+                "limit": fetch_k,
+            }
+            conn = conn_future.result()
+            if fetch_k > HNSW_EF_SEARCH:
+                # O índice HNSW retorna no máximo ef_search linhas; amplia-o só para esta consulta.
+                with conn.transaction():
+                    conn.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(fetch_k),))
+                    rows = conn.execute(self.query, params).fetchall()
+            else:
+                rows = conn.execute(self.query, params).fetchall()
+        finally:
+            if conn_future.exception() is None:
+                self.pool.putconn(conn_future.result())
+
+        selected = maximal_marginal_relevance(query_embedding, [row[3] for row in rows], k, lambda_mult)
+        similar_docs = [
+            (Document(id=rows[i][0], page_content=rows[i][1], metadata=rows[i][2]), rows[i][4])
+            for i in selected
+        ]
         self.verbose_print(f"Encontrados {len(similar_docs)} documentos similares.")
+        semantic_cache.add(query_embedding, similar_docs)
+        self._remember(key, similar_docs)
         return similar_docs
 
+    def _remember(self, key: tuple, docs_with_scores):
+        """Armazena o resultado no cache de consultas idênticas, descartando a entrada mais antiga se necessário."""
+        if len(self.exact_cache) >= SEMANTIC_CACHE_SIZE:
+            self.exact_cache.pop(next(iter(self.exact_cache)))
+        self.exact_cache[key] = docs_with_scores
+
 # Carrega as variáveis de ambiente do arquivo .env no escopo global
 load_dotenv()
 
@@ -50,8 +224,8 @@ if __name__ == '__main__':
         "--provider",
         type=str,
         default="google",
-        choices=['google', 'openai'],
-        help="O provedor de LLM a ser usado: 'google' ou 'openai' (padrão: google)."
+        choices=['google', 'openai', 'local', 'local-onnx'],
+        help="O provedor de embeddings a ser usado: 'google', 'openai', 'local' ou 'local-onnx' (padrão: google)."
     )
     parser.add_argument(
         "--query", 
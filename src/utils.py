@@ -1,40 +1,176 @@
 import os
+from functools import lru_cache
+import psycopg
+from sqlalchemy import create_engine
+from psycopg_pool import ConnectionPool, PoolTimeout
+from pgvector.psycopg import register_vector
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_openai import OpenAIEmbeddings
 
+LOCAL_EMBEDDINGS_MODEL = "BAAI/bge-small-en-v1.5"
+ONNX_EMBEDDINGS_DIR = "models/all-MiniLM-L6-v2-int8"
+
+# Candidatos examinados por uma busca no índice HNSW; limita quantas linhas a busca retorna.
+HNSW_EF_SEARCH = 100
+
+# Tempo máximo (em segundos) para abrir o pool de conexões ou obter uma conexão dele.
+POOL_TIMEOUT = 5
+
+DB_VARS = ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_HOST", "POSTGRES_PORT", "POSTGRES_DB")
+
 def get_connection_string() -> str:
     """Constrói a string de conexão a partir das variáveis de ambiente."""
-    user = os.getenv("POSTGRES_USER")
-    password = os.getenv("POSTGRES_PASSWORD")
-    host = os.getenv("POSTGRES_HOST")
-    port = os.getenv("POSTGRES_PORT")
-    db = os.getenv("POSTGRES_DB")
+    user, password, host, port, db = (os.environ.get(var) for var in DB_VARS)
     return f"postgresql+psycopg://{user}:{password}@{host}:{port}/{db}"
 
+def get_psycopg_connection_string() -> str:
+    """Retorna a string de conexão no formato aceito diretamente pelo psycopg."""
+    return get_connection_string().replace("postgresql+psycopg://", "postgresql://", 1)
+
 def check_env_vars(provider: str):
     """Verifica se as variáveis de ambiente necessárias estão definidas."""
-    db_vars = ["POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_HOST", "POSTGRES_PORT", "POSTGRES_DB"]
-    if not all(os.getenv(var) for var in db_vars):
-        missing = [var for var in db_vars if not os.getenv(var)]
+    env = os.environ
+    missing = [var for var in DB_VARS if not env.get(var)]
+    if missing:
         raise EnvironmentError(f"Variáveis de banco de dados ausentes: {', '.join(missing)}")
 
-    if provider == 'google' and not os.getenv("GOOGLE_API_KEY"):
+    if provider == 'google' and not env.get("GOOGLE_API_KEY"):
         raise EnvironmentError("Para o provedor 'google', a GOOGLE_API_KEY é necessária.")
-    elif provider == 'openai' and not os.getenv("OPENAI_API_KEY"):
+    elif provider == 'openai' and not env.get("OPENAI_API_KEY"):
         raise EnvironmentError("Para o provedor 'openai', a OPENAI_API_KEY é necessária.")
 
+@lru_cache(maxsize=4)
+def _cached_embeddings(provider: str):
+    """Cria o modelo de embeddings uma única vez por provedor."""
+    if provider == 'google':
+        return GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+    elif provider == 'openai':
+        return OpenAIEmbeddings(model="text-embedding-3-small")
+    elif provider == 'local':
+        try:
+            import torch
+            from langchain_huggingface import HuggingFaceEmbeddings
+        except ImportError as e:
+            raise ValueError(
+                "Para o provedor 'local', instale: pip install langchain-huggingface sentence-transformers"
+            ) from e
+        return HuggingFaceEmbeddings(
+            model_name=LOCAL_EMBEDDINGS_MODEL,
+            model_kwargs={"device": "cuda" if torch.cuda.is_available() else "cpu"},
+            encode_kwargs={"batch_size": 32, "normalize_embeddings": True},
+        )
+    elif provider == 'local-onnx':
+        try:
+            from src.onnx_embeddings import OnnxEmbeddings
+        except ImportError as e:
+            raise ValueError(
+                "Para o provedor 'local-onnx', instale: pip install onnxruntime tokenizers"
+            ) from e
+        model_dir = os.environ.get("ONNX_EMBEDDINGS_DIR") or ONNX_EMBEDDINGS_DIR
+        try:
+            return OnnxEmbeddings(model_dir)
+        except Exception as e:
+            raise ValueError(
+                f"Não foi possível carregar o modelo ONNX de '{model_dir}' ({e}). Verifique a variável "
+                "ONNX_EMBEDDINGS_DIR e gere o modelo seguindo os passos do provedor 'local-onnx' no README."
+            ) from e
+    else:
+        raise ValueError("Provedor inválido. Escolha 'google', 'openai', 'local' ou 'local-onnx'.")
+
 def get_embeddings_model(provider: str, verbose: bool = False):
     """Retorna a instância do modelo de embeddings com base no provedor."""
     verbose_print = v_print(verbose)
     
     if provider == 'google':
         verbose_print("Usando o modelo de embeddings do Google (models/embedding-001).")
-        return GoogleGenerativeAIEmbeddings(model="models/embedding-001")
     elif provider == 'openai':
         verbose_print("Usando o modelo de embeddings da OpenAI (text-embedding-3-small).")
-        return OpenAIEmbeddings(model="text-embedding-3-small")
-    else:
-        raise ValueError("Provedor inválido. Escolha 'google' ou 'openai'.")
+    elif provider == 'local':
+        verbose_print(f"Usando o modelo de embeddings local ({LOCAL_EMBEDDINGS_MODEL}).")
+    elif provider == 'local-onnx':
+        verbose_print("Usando o modelo de embeddings local em ONNX (all-MiniLM-L6-v2, int8).")
+    return _cached_embeddings(provider)
+
+@lru_cache(maxsize=4)
+def get_engine(connection_string: str):
+    """Retorna uma engine SQLAlchemy compartilhada para a string de conexão."""
+    return create_engine(connection_string, pool_pre_ping=True)
+
+def _configure_connection(conn):
+    """Registra os tipos do pgvector na conexão, quando a extensão já existe no banco."""
+    try:
+        register_vector(conn)
+    except psycopg.ProgrammingError:
+        # Extensão ainda não criada (nenhuma ingestão executada); o buscador reporta o erro.
+        pass
+
+# Pools compartilhados por string de conexão (ver get_pool).
+_pools = {}
+
+def _open_pool(connection_string: str):
+    """
+    Abre um novo pool de conexões psycopg para a string de conexão.
+
+    As consultas são preparadas no servidor já na primeira execução e os tipos do
+    pgvector são registrados em cada nova conexão. Levanta PoolTimeout se as
+    conexões iniciais não puderem ser abertas em POOL_TIMEOUT segundos.
+    """
+    pool = ConnectionPool(
+        connection_string,
+        min_size=2,
+        max_size=10,
+        kwargs={
+            "autocommit": True,
+            "prepare_threshold": 0,
+            "options": f"-c hnsw.ef_search={HNSW_EF_SEARCH}",
+        },
+        configure=_configure_connection,
+        timeout=POOL_TIMEOUT,
+        open=False,
+    )
+    try:
+        pool.open(wait=True, timeout=POOL_TIMEOUT)
+    except PoolTimeout:
+        pool.close()
+        raise
+    return pool
+
+def get_pool(connection_string: str):
+    """
+    Retorna o pool compartilhado para a string de conexão, abrindo-o se necessário.
+
+    Um pool novo só é compartilhado se o banco já tiver a extensão vector e as
+    tabelas do langchain-postgres, já que antes disso as conexões são abertas sem
+    os tipos do pgvector. Caso contrário, o pool é fechado e None é retornado.
+    """
+    pool = _pools.get(connection_string)
+    if pool is not None:
+        return pool
+
+    pool = _open_pool(connection_string)
+    try:
+        with pool.connection() as conn:
+            initialized = conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'vector') "
+                "AND to_regclass('langchain_pg_collection') IS NOT NULL "
+                "AND to_regclass('langchain_pg_embedding') IS NOT NULL"
+            ).fetchone()[0]
+    except Exception:
+        pool.close()
+        raise
+    if not initialized:
+        pool.close()
+        return None
+
+    shared = _pools.setdefault(connection_string, pool)
+    if shared is not pool:
+        # Outro buscador compartilhou um pool para a mesma string de conexão antes.
+        pool.close()
+    return shared
+
+def hnsw_index_prefix(collection_id) -> str:
+    """Retorna o prefixo dos nomes dos índices HNSW de uma coleção (um índice por tipo e dimensão)."""
+    return f"idx_emb_hnsw_{collection_id.hex}_"
 
 def v_print(verbose: bool):
     """Retorna uma função de print que só imprime se verbose for True."""